@@ -1,86 +1,229 @@
 import imaplib
 import email
-from email.header import decode_header
+import email.policy
 import requests
-from typing import Dict, Any
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional, Tuple
 import os
 from flask import Flask, jsonify
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import time
 import random
+import threading
+import atexit
+import socket
+import re
+
+# Process-lifetime IMAP connections, keyed by (imap_host, username)
+_imap_pool: Dict[Tuple[str, str], imaplib.IMAP4_SSL] = {}
+_imap_pool_lock = threading.Lock()
+_imap_pool_in_use: Dict[Tuple[str, str], threading.BoundedSemaphore] = {}
+
+def _discard_imap(key: Tuple[str, str], imap: imaplib.IMAP4_SSL):
+    """Remove a connection from the pool and log it out"""
+    with _imap_pool_lock:
+        if _imap_pool.get(key) is imap:
+            del _imap_pool[key]
+    try:
+        imap.logout()
+    except Exception:
+        pass
+
+def _close_imap_pool():
+    """Log out of every pooled IMAP connection"""
+    with _imap_pool_lock:
+        connections = list(_imap_pool.values())
+        _imap_pool.clear()
+    for imap in connections:
+        try:
+            imap.logout()
+        except Exception:
+            pass
+
+atexit.register(_close_imap_pool)
+
+# Untagged new-mail notification received while in IDLE
+_EXISTS_RE = re.compile(rb"^\* \d+ EXISTS", re.IGNORECASE)
+
+# Tokens in an IMAP parenthesized list: parentheses, quoted strings and atoms
+_IMAP_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_LITERAL_RE = re.compile(rb"\{(\d+)\}$")
+_FETCH_START_RE = re.compile(rb"^\d+ \(")
+_UID_RE = re.compile(rb"\bUID (\d+)", re.IGNORECASE)
+
+def _parse_imap_list(data: bytes) -> List[Any]:
+    """Parse the first IMAP parenthesized list (e.g. a BODYSTRUCTURE) into nested lists"""
+    stack = [[]]
+    pos = 0
+    while True:
+        match = _IMAP_TOKEN_RE.match(data, pos)
+        if not match:
+            return []
+        pos = match.end()
+        opening, closing, quoted, atom = match.groups()
+        if len(stack) == 1 and not opening:
+            # Anything but a list here (e.g. NIL) means there is no structure to parse
+            return []
+        if opening:
+            stack.append([])
+        elif closing:
+            if len(stack) == 1:
+                return []
+            item = stack.pop()
+            if len(stack) == 1:
+                return item
+            stack[-1].append(item)
+        elif quoted is not None:
+            stack[-1].append(re.sub(rb"\\(.)", rb"\1", quoted).decode("utf-8", "replace"))
+        else:
+            value = atom.decode("utf-8", "replace")
+            stack[-1].append(None if value.upper() == "NIL" else value)
+
+def _split_fetch_response(msg_data: List[Any]) -> Tuple[bytes, bytes]:
+    """Split a FETCH response into its BODY[...] literal and the remaining response text"""
+    literal = b""
+    text = b""
+    for item in msg_data:
+        if isinstance(item, tuple):
+            prefix, content = item
+            marker = _LITERAL_RE.search(prefix.rstrip())
+            head = prefix[:marker.start()] if marker else prefix
+            if head.rstrip().endswith(b"]") or head.rstrip().endswith(b">"):
+                literal = content
+                text += head
+            else:
+                # A string sent as a literal inside the response text, e.g. a filename
+                quoted = content.replace(b"\\", b"\\\\").replace(b'"', b'\\"')
+                text += head + b'"' + quoted + b'"'
+        elif isinstance(item, bytes):
+            text += item
+    return literal, text
+
+def _group_fetch_response(msg_data: List[Any]) -> Dict[bytes, List[Any]]:
+    """Split a multi-message FETCH response into per-message pieces keyed by UID"""
+    groups = []
+    for item in msg_data:
+        start = item[0] if isinstance(item, tuple) else item
+        if not isinstance(start, bytes):
+            continue
+        if _FETCH_START_RE.match(start) or not groups:
+            groups.append([])
+        groups[-1].append(item)
+
+    responses = {}
+    for group in groups:
+        _, text = _split_fetch_response(group)
+        match = _UID_RE.search(text)
+        if match:
+            responses[match.group(1)] = group
+    return responses
+
+def _uid_set(uids: List[bytes]) -> str:
+    """Build an IMAP UID set, collapsing consecutive UIDs into a:b ranges"""
+    ranges = []
+    for uid in sorted({int(uid) for uid in uids}):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(first) if first == last else f"{first}:{last}" for first, last in ranges)
 
 class EmailTicketParser:
-    def __init__(self, imap_host: str, username: str, password: str, webhook_url: str):
+    IDLE_TIMEOUT = 25 * 60  # Re-issue IDLE before the server's 30 minute cutoff
+    RETRY_INTERVAL = 60  # Seconds before retrying tickets the webhook rejected
+    POLL_INTERVAL = 60  # Seconds between scans on servers without IDLE
+    MAX_BACKOFF = 60  # Maximum seconds between reconnect attempts
+    MAX_BODY_BYTES = 64 * 1024  # Longer body parts are truncated to this many bytes
+    FETCH_CHUNK_SIZE = 100  # Messages fetched, sent and flagged per pass
+    WEBHOOK_BATCH_SIZE = 25  # Tickets sent per webhook request when batching is enabled
+    WEBHOOK_WORKERS = 4  # Concurrent webhook requests, matching the session pool size
+
+    def __init__(
+        self,
+        imap_host: str,
+        username: str,
+        password: str,
+        webhook_url: str,
+        batch_webhook: bool = False
+    ):
         self.imap_host = imap_host
         self.username = username
         self.password = password
         self.webhook_url = webhook_url
-        self.blocked_senders = [
+        # Only enable for receivers that understand the {"is_batched", "events"} envelope
+        self.batch_webhook = batch_webhook
+        self.blocked_senders = frozenset(sender.lower() for sender in [
             "noreply@ingeniumstem.org",
             "Mailer-Daemon@mx1.mxfilter.net"
-        ]
-        self._lock = False
-        self._last_connection_time = 0
-        self.MIN_CONNECTION_INTERVAL = 2  # Minimum seconds between connections
-
-    def _wait_for_connection(self):
-        """Implement connection rate limiting"""
-        while self._lock:
-            time.sleep(0.5)
-        
-        time_since_last = time.time() - self._last_connection_time
-        if time_since_last < self.MIN_CONNECTION_INTERVAL:
-            time.sleep(self.MIN_CONNECTION_INTERVAL - time_since_last)
+        ])
+        self.processed_count = 0
 
-    @contextmanager
-    def imap_connection(self, max_retries=3):
-        """Context manager for handling IMAP connections with retry logic"""
-        self._wait_for_connection()
-        self._lock = True
-        imap = None
+        # Reuse one HTTP session so webhook requests share a warm connection pool
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.WEBHOOK_WORKERS)
+        self.session.mount("https://", adapter)
+
+    def _connect(self, max_retries=3) -> imaplib.IMAP4_SSL:
+        """Open and log in to a new IMAP connection with retry logic"""
         retry_count = 0
-        
-        while retry_count < max_retries:
+        while True:
             try:
                 print(f"Connecting to IMAP server (attempt {retry_count + 1})...")
                 imap = imaplib.IMAP4_SSL(self.imap_host, 993)
                 imap.login(self.username, self.password)
-                self._last_connection_time = time.time()
-                yield imap
-                break
-            except OSError as e:
+                return imap
+            except OSError:
                 retry_count += 1
                 if retry_count >= max_retries:
                     raise
                 wait_time = random.uniform(1, 3) * retry_count
                 print(f"Connection failed. Retrying in {wait_time:.1f} seconds...")
                 time.sleep(wait_time)
-                if imap:
-                    try:
-                        imap.logout()
-                    except:
-                        pass
-            except Exception as e:
+
+    @contextmanager
+    def imap_connection(self, max_retries=3):
+        """Context manager yielding a pooled IMAP connection, reconnecting if it dropped"""
+        key = (self.imap_host, self.username)
+        with _imap_pool_lock:
+            in_use = _imap_pool_in_use.setdefault(key, threading.BoundedSemaphore(1))
+
+        # Concurrent polling requests and the IDLE watcher share one pooled connection,
+        # and imaplib is not thread-safe, so callers take turns
+        with in_use:
+            with _imap_pool_lock:
+                imap = _imap_pool.get(key)
+
+            if imap is not None:
+                try:
+                    status, _ = imap.noop()
+                except (imaplib.IMAP4.abort, OSError):
+                    status = None
+                if status != 'OK':
+                    print("Pooled IMAP connection is stale, reconnecting...")
+                    _discard_imap(key, imap)
+                    imap = None
+
+            if imap is None:
+                imap = self._connect(max_retries)
+                with _imap_pool_lock:
+                    _imap_pool[key] = imap
+
+            try:
+                yield imap
+            except Exception:
+                # The connection may be mid-command (e.g. still in IDLE), so never pool it again
+                _discard_imap(key, imap)
                 raise
-            finally:
-                if imap:
-                    try:
-                        imap.close()
-                    except:
-                        pass
-                    try:
-                        imap.logout()
-                    except:
-                        pass
-                self._lock = False
-
-    def decode_email_header(self, header: str) -> str:
-        """Decode email header"""
-        decoded_header = decode_header(header)
-        return ' '.join([
-            text.decode(encoding or 'utf-8') if isinstance(text, bytes) else text
-            for text, encoding in decoded_header
-        ])
+
+            # Leave the mailbox without the EXPUNGE that CLOSE would trigger; servers
+            # without UNSELECT keep the mailbox selected until the next SELECT
+            if imap.state == 'SELECTED' and 'UNSELECT' in imap.capabilities:
+                try:
+                    imap.unselect()
+                except imaplib.IMAP4.error:
+                    pass
 
     def parse_sender_name(self, from_header: str) -> tuple[str, str]:
         """Extract first and last name from email sender"""
@@ -95,23 +238,34 @@ class EmailTicketParser:
             return name_parts[0], ""
         return "", ""
 
-    def create_ticket_payload(self, msg: email.message.Message) -> Dict[str, Any]:
-        """Create ticket payload from email message"""
-        print("Creating ticket payload...")
-        subject = self.decode_email_header(msg["subject"] or "No Subject")
-        from_header = self.decode_email_header(msg["from"])
+    def _parse_from(self, msg: email.message.EmailMessage) -> Tuple[str, str, str, str]:
+        """Read the From header once, returning it with the sender's address and name"""
+        from_header = str(msg["from"] or "")
         sender_email = email.utils.parseaddr(from_header)[1]
         first_name, last_name = self.parse_sender_name(from_header)
+        return from_header, sender_email, first_name, last_name
 
-        # Get email body
+    def create_ticket_payload(
+        self,
+        msg: email.message.EmailMessage,
+        from_info: Optional[Tuple[str, str, str, str]] = None
+    ) -> Dict[str, Any]:
+        """Create ticket payload from email message"""
+        print("Creating ticket payload...")
+        subject = str(msg["subject"] or "No Subject")
+        if from_info is None:
+            from_info = self._parse_from(msg)
+        _, sender_email, first_name, last_name = from_info
+
+        # Get email body, preferring plain text over HTML and skipping attachments
         body = ""
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == "text/plain":
-                    body = part.get_payload(decode=True).decode()
-                    break
-        else:
-            body = msg.get_payload(decode=True).decode()
+        part = msg.get_body(preferencelist=('plain', 'html'))
+        if part is not None:
+            try:
+                body = part.get_content()
+            except LookupError:
+                # Unknown charset; fall back to UTF-8
+                body = (part.get_payload(decode=True) or b"").decode("utf-8", errors="replace")
 
         return {
             "title": subject,
@@ -127,16 +281,228 @@ class EmailTicketParser:
     def send_to_webhook(self, payload: Dict[str, Any]) -> bool:
         """Send ticket data to Fluent Support webhook"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.webhook_url,
                 json=payload,
-                headers={"Content-Type": "application/json"}
+                timeout=10
             )
             return response.status_code == 200
         except Exception as e:
             print(f"Error sending to webhook: {e}")
             return False
 
+    def send_to_webhook_batch(self, payloads: List[Dict[str, Any]]) -> bool:
+        """Send a batch of ticket payloads to the webhook in a single request"""
+        try:
+            response = self.session.post(
+                self.webhook_url,
+                json={"is_batched": True, "events": payloads},
+                timeout=10
+            )
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Error sending batch to webhook: {e}")
+            return False
+
+    def _send_batch(self, payloads: List[Dict[str, Any]]) -> bool:
+        """Send tickets using the configured webhook format"""
+        if self.batch_webhook:
+            return self.send_to_webhook_batch(payloads)
+        return all(self.send_to_webhook(payload) for payload in payloads)
+
+    def _find_text_part(
+        self,
+        structure: List[Any],
+        section: str = "",
+        subtype: str = "plain"
+    ) -> Optional[Tuple[str, List[Any]]]:
+        """Locate the first inline text part of the given subtype in a BODYSTRUCTURE, returning its section and fields"""
+        if structure and isinstance(structure[0], list):
+            # Multipart: child parts come first, followed by the subtype
+            for index, part in enumerate(structure):
+                if not isinstance(part, list):
+                    break
+                child = f"{section}.{index + 1}" if section else str(index + 1)
+                found = self._find_text_part(part, child, subtype)
+                if found:
+                    return found
+            return None
+
+        # A single-part message's body is section 1 whatever its type
+        if not section:
+            return ("1", structure) if len(structure) > 6 else None
+        if len(structure) > 6 and str(structure[0]).lower() == "text" and str(structure[1]).lower() == subtype:
+            # Text parts carry their disposition after the line count and MD5
+            disposition = structure[9] if len(structure) > 9 else None
+            if isinstance(disposition, list) and str(disposition[0]).lower() == "attachment":
+                return None
+            return section, structure
+        return None
+
+    def _fetch_messages(self, imap: imaplib.IMAP4_SSL, uids: List[bytes]) -> List[Tuple[bytes, email.message.EmailMessage]]:
+        """Fetch the Subject/From headers and first text/plain (or text/html) part of each message by UID"""
+        uid_set = _uid_set(uids)
+        status, msg_data = imap.uid("FETCH", uid_set, "(BODY.PEEK[HEADER.FIELDS (SUBJECT FROM)] BODYSTRUCTURE)")
+        if status != 'OK':
+            print(f"Failed to fetch messages {uid_set}")
+            return []
+
+        if not msg_data or not msg_data[0]:
+            print(f"No data received for messages {uid_set}")
+            return []
+
+        headers = {}
+        parts = {}
+        sections = {}
+        for uid, response in _group_fetch_response(msg_data).items():
+            header, text = _split_fetch_response(response)
+            headers[uid] = header.rstrip(b"\r\n")
+            start = text.upper().find(b"BODYSTRUCTURE")
+            if start == -1:
+                continue
+            try:
+                structure = _parse_imap_list(text[start + len(b"BODYSTRUCTURE"):])
+                # Fall back to the HTML part for messages without a plain text alternative
+                found = self._find_text_part(structure) or self._find_text_part(structure, subtype="html")
+                if found:
+                    section, fields = found
+                    size = int(fields[6] or 0)
+                    parts[uid] = fields
+                    if size:
+                        sections.setdefault(section, []).append(uid)
+            except Exception as e:
+                # Still create the ticket from the headers, just without a body
+                print(f"Unreadable BODYSTRUCTURE for message {uid}: {e}")
+                parts.pop(uid, None)
+
+        # One FETCH per distinct section; partial fetches stop at each part's real size
+        bodies = {}
+        for section, section_uids in sections.items():
+            status, body_data = imap.uid(
+                "FETCH",
+                _uid_set(section_uids),
+                f"(BODY.PEEK[{section}]<0.{self.MAX_BODY_BYTES}>)"
+            )
+            if status != 'OK' or not body_data:
+                print(f"Failed to fetch body section {section}")
+                continue
+            for uid, response in _group_fetch_response(body_data).items():
+                bodies[uid], _ = _split_fetch_response(response)
+
+        messages = []
+        for uid in uids:
+            if uid not in headers:
+                print(f"No data received for message {uid}")
+                continue
+
+            try:
+                header = headers[uid]
+                fields = parts.get(uid)
+                if fields:
+                    # Describe the fetched part so the parser can decode it
+                    params = fields[2] if isinstance(fields[2], list) else []
+                    content_type = f"{fields[0]}/{fields[1]}".lower()
+                    for name, value in zip(params[::2], params[1::2]):
+                        escaped = str(value).replace('"', '\\"')
+                        content_type += f'; {name}="{escaped}"'
+                    header += f"\r\nContent-Type: {content_type}".encode()
+                    if fields[5]:
+                        header += f"\r\nContent-Transfer-Encoding: {fields[5]}".encode()
+
+                messages.append((uid, email.message_from_bytes(
+                    header + b"\r\n\r\n" + bodies.get(uid, b""),
+                    policy=email.policy.default
+                )))
+            except Exception as e:
+                print(f"Error processing message {uid}: {e}")
+        return messages
+
+    def _process_messages(self, imap: imaplib.IMAP4_SSL, uids: List[bytes]) -> bool:
+        """Create tickets for the given messages, returning False if any could not be fetched or sent"""
+        all_sent = True
+        # Work in chunks to bound the command length and the bodies held in memory
+        for i in range(0, len(uids), self.FETCH_CHUNK_SIZE):
+            all_sent = self._process_chunk(imap, uids[i:i + self.FETCH_CHUNK_SIZE]) and all_sent
+        return all_sent
+
+    def _process_chunk(self, imap: imaplib.IMAP4_SSL, uids: List[bytes]) -> bool:
+        """Fetch, send and flag one chunk of messages, returning False if any could not be fetched or sent"""
+        pending = []
+        # Fetch only the headers and text part each ticket needs
+        messages = self._fetch_messages(imap, uids)
+        fetched_all = len(messages) == len(uids)
+        for uid, msg in messages:
+            try:
+                # Skip blocked senders
+                from_info = self._parse_from(msg)
+                sender_email = from_info[1]
+                # parseaddr returns a bare word such as "Undisclosed" as the address
+                if '@' not in sender_email:
+                    print(f"Skipping message {uid} with malformed From header")
+                    continue
+                if sender_email.lower() in self.blocked_senders:
+                    print(f"Skipping blocked sender: {sender_email}")
+                    continue
+
+                # Queue ticket for the webhook
+                ticket_payload = self.create_ticket_payload(msg, from_info)
+                pending.append((uid, ticket_payload))
+
+            except Exception as e:
+                print(f"Error processing message {uid}: {e}")
+                continue
+
+        if not pending:
+            return fetched_all
+
+        # Send queued tickets one per request, or in batches if enabled, posting concurrently
+        batch_size = self.WEBHOOK_BATCH_SIZE if self.batch_webhook else 1
+        batches = [
+            pending[i:i + batch_size]
+            for i in range(0, len(pending), batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=min(len(batches), self.WEBHOOK_WORKERS)) as executor:
+            results = executor.map(
+                lambda batch: (batch, self._send_batch([payload for _, payload in batch])),
+                batches
+            )
+
+            # IMAP calls stay on this thread; only the webhook requests run in the pool
+            sent = []
+            for batch, success in results:
+                for _, ticket_payload in batch:
+                    if success:
+                        print(f"Created ticket for email: {ticket_payload['title']}")
+                    else:
+                        print(f"Failed to create ticket for email: {ticket_payload['title']}")
+                if success:
+                    sent.extend(uid for uid, _ in batch)
+
+        if not sent:
+            return False
+
+        # Mark emails as read only if ticket creation was successful
+        success_uids = _uid_set(sent)
+        status, _ = imap.uid("STORE", success_uids, "+FLAGS", "(\\Seen)")
+        if status != 'OK':
+            print(f"Failed to mark messages {success_uids} as read")
+        self.processed_count += len(sent)
+        return fetched_all and len(sent) == len(pending)
+
+    def _process_unseen(self, imap: imaplib.IMAP4_SSL) -> bool:
+        """Create tickets for every unread message, returning False if any could not be fetched or sent"""
+        # Search for unread emails
+        uids = self._search_unseen(imap)
+        if uids is None:
+            return False
+
+        # Check if we have any messages
+        if not uids:
+            print("No unread messages found")
+            return True
+
+        return self._process_messages(imap, uids)
+
     def process_emails(self):
         """Process unread emails and create tickets"""
         try:
@@ -147,72 +513,174 @@ class EmailTicketParser:
                     print("Failed to select INBOX")
                     return
 
-                # Search for unread emails
-                status, message_numbers = imap.search(None, "UNSEEN")
-                if status != 'OK':
-                    print("Failed to search for unread messages")
-                    return
+                self._process_unseen(imap)
 
-                # Check if we have any messages
-                if not message_numbers or not message_numbers[0]:
-                    print("No unread messages found")
-                    return
+        except Exception as e:
+            print(f"Error during email processing: {e}")
+
+    def _wait_for_data(self, imap: imaplib.IMAP4_SSL, timeout: float) -> bool:
+        """Wait until a response line can be read, returning False if the timeout passes first"""
+        imap.sock.settimeout(timeout)
+        try:
+            # peek() returns already-buffered lines immediately and only waits on the socket if the buffer is empty
+            imap.file.peek(1)
+            return True
+        except socket.timeout:
+            # The buffer was empty, so replacing the reader the timeout invalidated loses no data
+            imap.file = imap.sock.makefile('rb')
+            return False
+        finally:
+            imap.sock.settimeout(None)
+
+    def _idle(self, imap: imaplib.IMAP4_SSL, timeout: float) -> bool:
+        """Wait in IDLE until the server reports new mail, returning False if the timeout passes first"""
+        # EXISTS/EXPUNGE sent during earlier commands were filed away by imaplib and won't be repeated
+        arrived = imap.untagged_responses.pop('EXISTS', None)
+        imap.untagged_responses.pop('EXPUNGE', None)
+        if arrived:
+            return True
+
+        # imaplib has no IDLE support before Python 3.14, so the command is sent by hand
+        # using imaplib's own tag generator to keep tags unique on this connection
+        tag = imap._new_tag()
+        imap.send(tag + b" IDLE\r\n")
+        line = imap.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+
+        # Wait for untagged responses until the server reports new mail
+        new_mail = False
+        deadline = time.monotonic() + timeout
+        while not new_mail:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._wait_for_data(imap, remaining):
+                break
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed during IDLE")
+            new_mail = bool(_EXISTS_RE.match(line))
+
+        # Leave IDLE, picking up any responses sent before the server saw DONE
+        imap.send(b"DONE\r\n")
+        while True:
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed while leaving IDLE")
+            if line.startswith(tag):
+                if not line[len(tag):].lstrip().startswith(b"OK"):
+                    raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+                return new_mail
+            new_mail = new_mail or bool(_EXISTS_RE.match(line))
 
-                # Process each message
-                for num in message_numbers[0].split():
-                    try:
-                        # Fetch email message
-                        status, msg_data = imap.fetch(num, "(RFC822)")
-                        if status != 'OK':
-                            print(f"Failed to fetch message {num}")
-                            continue
-
-                        if not msg_data or not msg_data[0]:
-                            print(f"No data received for message {num}")
-                            continue
-
-                        email_body = msg_data[0][1]
-                        msg = email.message_from_bytes(email_body)
-
-                        # Skip blocked senders
-                        sender_email = email.utils.parseaddr(msg["from"])[1]
-                        if sender_email in self.blocked_senders:
-                            print(f"Skipping blocked sender: {sender_email}")
-                            continue
-
-                        # Create and send ticket
-                        ticket_payload = self.create_ticket_payload(msg)
-                        if self.send_to_webhook(ticket_payload):
-                            # Mark email as read only if ticket creation was successful
-                            imap.store(num, '+FLAGS', '\\Seen')
-                            print(f"Created ticket for email: {ticket_payload['title']}")
+    def _wait_for_mail(self, imap: imaplib.IMAP4_SSL, timeout: float) -> bool:
+        """Wait for new mail with IDLE, or sleep for a polling interval on servers without it"""
+        if 'IDLE' in imap.capabilities:
+            return self._idle(imap, timeout)
+        time.sleep(min(timeout, self.POLL_INTERVAL))
+        return False
+
+    def _search_unseen(self, imap: imaplib.IMAP4_SSL, after_uid: int = 0) -> Optional[List[bytes]]:
+        """Return the UIDs of unread messages above after_uid, or None if the search failed"""
+        criteria = ["UNSEEN", "UNDELETED"]
+        if after_uid:
+            criteria = ["UID", f"{after_uid + 1}:*"] + criteria
+        status, uids = imap.uid("SEARCH", None, *criteria)
+        if status != 'OK':
+            print("Failed to search for unread messages")
+            return None
+
+        # "n:*" always matches the highest UID, even when that is below n
+        return [uid for uid in (uids[0] or b"").split() if int(uid) > after_uid]
+
+    def watch_inbox(self):
+        """Process new mail as it arrives using IMAP IDLE, reconnecting with exponential backoff"""
+        backoff = 1
+        while True:
+            try:
+                # Hold the pooled connection for as long as it stays in IDLE
+                with self.imap_connection() as imap:
+                    status, _ = imap.select("INBOX")
+                    if status != 'OK':
+                        raise imaplib.IMAP4.error("Failed to select INBOX")
+                    backoff = 1
+
+                    # Start with a full scan to catch up on anything delivered while disconnected
+                    last_uid = 0
+                    new_mail = False
+                    all_sent = True
+                    while True:
+                        # New mail only needs UIDs above the last one seen; otherwise rescan
+                        # everything so tickets the webhook rejected are retried
+                        uids = self._search_unseen(imap, last_uid if new_mail else 0)
+                        if uids is None:
+                            all_sent = False
                         else:
-                            print(f"Failed to create ticket for email: {ticket_payload['title']}")
+                            if uids:
+                                last_uid = max(last_uid, max(int(uid) for uid in uids))
+                            sent = self._process_messages(imap, uids) if uids else True
+                            all_sent = (sent and all_sent) if new_mail else sent
 
-                    except Exception as e:
-                        print(f"Error processing message {num}: {e}")
-                        continue
+                        # Come back sooner to retry tickets the webhook rejected
+                        timeout = self.IDLE_TIMEOUT if all_sent else self.RETRY_INTERVAL
+                        new_mail = self._wait_for_mail(imap, timeout)
 
-        except Exception as e:
-            print(f"Error during email processing: {e}")
+            except Exception as e:
+                print(f"IDLE connection lost: {e}. Reconnecting in {backoff} seconds...")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.MAX_BACKOFF)
 
 config = {
     "imap_host": os.getenv("IMAP_HOST"),
     "username": os.getenv("USERNAME"),
     "password": os.getenv("PASSWORD"),
-    "webhook_url": os.getenv("WEBHOOK_URL")
+    "webhook_url": os.getenv("WEBHOOK_URL"),
+    "batch_webhook": os.getenv("WEBHOOK_BATCHED", "").lower() in ("1", "true", "yes")
 }
 
 app = Flask(__name__)
 
+_parser = None
+
+def get_parser() -> EmailTicketParser:
+    """Return the shared parser, creating it on first use"""
+    global _parser
+    if _parser is None:
+        _parser = EmailTicketParser(**config)
+    return _parser
+
+_watcher = None
+
+def start_watcher():
+    """Start the background IDLE thread if it is not already running
+
+    Only call this from a single long-lived process. Each process runs its own
+    watcher, so several workers would race on the same unread messages and
+    create duplicate tickets. Serverless instances are frozen between requests
+    and should rely on polling through /api/run-python instead.
+    """
+    global _watcher
+    if _watcher is None or not _watcher.is_alive():
+        _watcher = threading.Thread(target=get_parser().watch_inbox, daemon=True)
+        _watcher.start()
+
 @app.route('/api/run-python')
 def run_script():
     try:
-        parser = EmailTicketParser(**config)
-        parser.process_emails()
-        return jsonify({"status": "success", "message": "Execution finished"})
+        parser = get_parser()
+        # Poll unless the IDLE watcher is already handling new mail
+        watching = _watcher is not None and _watcher.is_alive()
+        if not watching:
+            parser.process_emails()
+        return jsonify({
+            "status": "success",
+            "message": "Execution finished",
+            "processed": parser.processed_count,
+            "watching": watching
+        })
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 if __name__ == '__main__':
+    if os.getenv("WATCH_INBOX", "").lower() in ("1", "true", "yes"):
+        start_watcher()
     app.run()
\ No newline at end of file
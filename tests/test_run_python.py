@@ -0,0 +1,454 @@
+import importlib.util
+import imaplib
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("requests")
+
+MODULE_PATH = os.path.join(os.path.dirname(__file__), "..", "api", "run-python.py")
+spec = importlib.util.spec_from_file_location("run_python", MODULE_PATH)
+run_python = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(run_python)
+
+
+def make_parser():
+    return run_python.EmailTicketParser("imap.example.com", "user", "secret", "https://example.com/hook")
+
+
+class FakeImapServer:
+    """Minimal IMAP server that answers each command name with canned bytes"""
+
+    def __init__(self, responses, capabilities=b"IMAP4rev1 IDLE"):
+        self.responses = responses
+        self.capabilities = capabilities
+        self.commands = []
+        self.connections = []
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            conn, _ = self.listener.accept()
+            self.connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn, conn.makefile("rb") as reader:
+            conn.sendall(b"* OK ready\r\n")
+            idle_tag = None
+            for line in reader:
+                parts = line.strip().split(b" ")
+                if parts[0] == b"DONE":
+                    conn.sendall(idle_tag + b" OK IDLE terminated\r\n")
+                    continue
+                tag, command = parts[0], parts[1].upper()
+                self.commands.append(command)
+                if command == b"IDLE":
+                    idle_tag = tag
+                    conn.sendall(self.responses.get(b"IDLE", b"+ idling\r\n"))
+                elif command == b"CAPABILITY":
+                    conn.sendall(b"* CAPABILITY " + self.capabilities + b"\r\n" + tag + b" OK done\r\n")
+                else:
+                    conn.sendall(self.responses.get(command, b"") + tag + b" OK done\r\n")
+
+    def connect(self, login=False):
+        imap = imaplib.IMAP4("127.0.0.1", self.port)
+        if login:
+            imap.login("user", "secret")
+        return imap
+
+
+def test_idle_sees_responses_buffered_with_continuation():
+    server = FakeImapServer({b"IDLE": b"+ idling\r\n* 3 EXPUNGE\r\n* 5 EXISTS\r\n"})
+    imap = server.connect()
+
+    start = time.monotonic()
+    assert make_parser()._idle(imap, timeout=5)
+    assert time.monotonic() - start < 2
+
+
+def test_idle_timeout_leaves_connection_usable():
+    server = FakeImapServer({})
+    imap = server.connect()
+
+    assert not make_parser()._idle(imap, timeout=0.2)
+    assert imap.noop()[0] == "OK"
+
+
+def test_idle_sees_exists_sent_during_earlier_command():
+    server = FakeImapServer({b"NOOP": b"* 6 EXISTS\r\n"})
+    imap = server.connect()
+    imap.noop()
+
+    start = time.monotonic()
+    assert make_parser()._idle(imap, timeout=5)
+    assert time.monotonic() - start < 2
+    assert b"IDLE" not in server.commands
+
+
+def test_wait_for_mail_polls_without_idle_capability(monkeypatch):
+    server = FakeImapServer({}, capabilities=b"IMAP4rev1")
+    imap = server.connect()
+    sleeps = []
+    monkeypatch.setattr(run_python.time, "sleep", sleeps.append)
+
+    assert not make_parser()._wait_for_mail(imap, timeout=25 * 60)
+    assert sleeps == [run_python.EmailTicketParser.POLL_INTERVAL]
+    assert b"IDLE" not in server.commands
+
+
+def test_search_unseen_ignores_highest_uid_below_range():
+    server = FakeImapServer({b"UID": b"* SEARCH 4\r\n"})
+    imap = server.connect(login=True)
+    imap.select("INBOX")
+
+    assert make_parser()._search_unseen(imap, after_uid=4) == []
+    assert make_parser()._search_unseen(imap) == [b"4"]
+
+
+@pytest.mark.parametrize("capabilities, unselected", [
+    (b"IMAP4rev1 UNSELECT", True),
+    (b"IMAP4rev1", False),
+])
+def test_process_emails_leaves_mailbox_without_close(monkeypatch, capabilities, unselected):
+    server = FakeImapServer({b"SELECT": b"* 0 EXISTS\r\n", b"UID": b"* SEARCH\r\n"}, capabilities)
+    parser = make_parser()
+    monkeypatch.setattr(parser, "_connect", lambda max_retries=3: server.connect(login=True))
+    monkeypatch.setattr(run_python, "_imap_pool", {})
+
+    parser.process_emails()
+    parser.process_emails()
+
+    assert server.commands.count(b"SELECT") == 2
+    assert (b"UNSELECT" in server.commands) == unselected
+    assert b"CLOSE" not in server.commands
+    assert b"LOGOUT" not in server.commands
+
+
+def test_concurrent_polls_take_turns_on_pooled_connection(monkeypatch):
+    server = FakeImapServer({b"SELECT": b"* 0 EXISTS\r\n", b"UID": b"* SEARCH\r\n"})
+    parser = make_parser()
+    monkeypatch.setattr(parser, "_connect", lambda max_retries=3: server.connect(login=True))
+    monkeypatch.setattr(run_python, "_imap_pool", {})
+
+    threads = [threading.Thread(target=parser.process_emails, daemon=True) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    # Every poll reused the one pooled connection in turn
+    assert server.commands.count(b"SELECT") == 4
+    assert server.commands.count(b"LOGIN") == 1
+
+
+def test_process_emails_replaces_connection_the_server_dropped(monkeypatch):
+    server = FakeImapServer({b"SELECT": b"* 0 EXISTS\r\n", b"UID": b"* SEARCH\r\n"})
+    parser = make_parser()
+    monkeypatch.setattr(parser, "_connect", lambda max_retries=3: server.connect(login=True))
+    monkeypatch.setattr(run_python, "_imap_pool", {})
+
+    parser.process_emails()
+    dropped = run_python._imap_pool[(parser.imap_host, parser.username)]
+    server.connections[0].shutdown(socket.SHUT_RDWR)
+    parser.process_emails()
+
+    assert len(server.connections) == 2
+    assert server.commands.count(b"LOGIN") == 2
+    assert server.commands.count(b"SELECT") == 2
+    assert run_python._imap_pool[(parser.imap_host, parser.username)] is not dropped
+
+
+class CannedImap:
+    """Stand-in for an imaplib connection that replays raw UID FETCH results"""
+
+    def __init__(self, *fetch_results):
+        self.fetch_results = list(fetch_results)
+        self.fetches = []
+
+    def uid(self, command, uid_set, items):
+        assert command == "FETCH"
+        self.fetches.append((uid_set, items))
+        return "OK", self.fetch_results.pop(0)
+
+
+HEADERS_A = b'Subject: Printer broken\r\nFrom: "Ada Lovelace" <ada@example.org>\r\n\r\n'
+HEADERS_B = b"Subject: =?utf-8?q?Caf=C3=A9?=\r\nFrom: bob@example.org\r\n\r\n"
+PLAIN_PART = b'("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 11 1 NIL NIL NIL NIL)'
+HTML_PART = b'("text" "html" ("charset" "utf-8") NIL NIL "7bit" 20 1 NIL NIL NIL NIL)'
+
+
+def literal(prefix, data):
+    return (prefix + b" {%d}" % len(data), data)
+
+
+def test_parse_imap_list_handles_nil_nesting_and_escapes():
+    parsed = run_python._parse_imap_list(b' ("text" "plain" ("name" "a \\"b\\".txt") NIL 12) trailing')
+
+    assert parsed == ["text", "plain", ["name", 'a "b".txt'], None, "12"]
+
+
+def test_parse_imap_list_requires_a_list():
+    assert run_python._parse_imap_list(b" NIL BODY[HEADER.FIELDS (SUBJECT FROM)]") == []
+
+
+def test_fetch_messages_survives_malformed_bodystructure():
+    imap = CannedImap(
+        [
+            literal(b"1 (UID 1 BODYSTRUCTURE NIL BODY[HEADER.FIELDS (SUBJECT FROM)]", HEADERS_A),
+            b")",
+            literal(b'2 (UID 2 BODYSTRUCTURE ("text" "plain") BODY[HEADER.FIELDS (SUBJECT FROM)]', HEADERS_A),
+            b")",
+            literal(b"3 (UID 3 BODYSTRUCTURE " + PLAIN_PART + b" BODY[HEADER.FIELDS (SUBJECT FROM)]", HEADERS_B),
+            b")",
+        ],
+        [
+            literal(b"3 (UID 3 BODY[1]<0>", b"Hello world"),
+            b")",
+        ],
+    )
+
+    messages = make_parser()._fetch_messages(imap, [b"1", b"2", b"3"])
+
+    # Messages with unusable structures still become tickets, just without a body
+    assert [uid for uid, _ in messages] == [b"1", b"2", b"3"]
+    assert imap.fetches[1] == ("3", "(BODY.PEEK[1]<0.65536>)")
+    assert make_parser().create_ticket_payload(messages[0][1])["content"] == ""
+    assert make_parser().create_ticket_payload(messages[2][1])["content"] == "Hello world"
+
+
+def test_fetch_messages_dovecot_ordering():
+    # Dovecot echoes UID first and BODYSTRUCTURE before the header literal
+    imap = CannedImap(
+        [
+            literal(b"1 (UID 5 BODYSTRUCTURE " + PLAIN_PART + b" BODY[HEADER.FIELDS (SUBJECT FROM)]", HEADERS_A),
+            b")",
+            literal(
+                b"2 (UID 7 BODYSTRUCTURE (" + PLAIN_PART + HTML_PART + b' "alternative" ("boundary" "b1") NIL NIL)'
+                b" BODY[HEADER.FIELDS (SUBJECT FROM)]",
+                HEADERS_B
+            ),
+            b")",
+        ],
+        [
+            literal(b"1 (UID 5 BODY[1]<0>", b"Hello world"),
+            b")",
+            literal(b"2 (UID 7 BODY[1]<0>", b"Bonjour tou"),
+            b")",
+        ],
+    )
+
+    messages = make_parser()._fetch_messages(imap, [b"5", b"7"])
+
+    assert [uid for uid, _ in messages] == [b"5", b"7"]
+    assert imap.fetches[1] == ("5,7", "(BODY.PEEK[1]<0.65536>)")
+    first = make_parser().create_ticket_payload(messages[0][1])
+    second = make_parser().create_ticket_payload(messages[1][1])
+    assert first["content"] == "Hello world"
+    assert first["sender"] == {"first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.org"}
+    assert second["title"] == "Caf\u00e9"
+    assert second["content"] == "Bonjour tou"
+
+
+def test_fetch_messages_gmail_ordering():
+    # Gmail sends the header literal first and UID last, after BODYSTRUCTURE
+    imap = CannedImap(
+        [
+            literal(b"1 (BODY[HEADER.FIELDS (SUBJECT FROM)]", HEADERS_A),
+            b" BODYSTRUCTURE (" + PLAIN_PART + HTML_PART + b' "alternative") UID 12)',
+        ],
+        [
+            literal(b"1 (UID 12 BODY[1]<0>", b"Hello world"),
+            b")",
+        ],
+    )
+
+    [(uid, msg)] = make_parser()._fetch_messages(imap, [b"12"])
+
+    assert uid == b"12"
+    assert make_parser().create_ticket_payload(msg)["content"] == "Hello world"
+
+
+def test_fetch_messages_skips_attachment_with_literal_filename():
+    # The attached text file comes first and its non-ASCII filename is sent as a literal
+    imap = CannedImap(
+        [
+            literal(
+                b'1 (UID 3 BODYSTRUCTURE (("text" "plain" ("charset" "utf-8" "name"',
+                b"r\xc3\xa9sum\xc3\xa9.txt"
+            ),
+            literal(
+                b') NIL NIL "base64" 400 6 NIL ("attachment" ("filename" "cv.txt")) NIL NIL)'
+                + PLAIN_PART + b' "mixed" ("boundary" "b2") NIL NIL) BODY[HEADER.FIELDS (SUBJECT FROM)]',
+                HEADERS_A
+            ),
+            b")",
+        ],
+        [
+            literal(b"1 (UID 3 BODY[2]<0>", b"Hello world"),
+            b")",
+        ],
+    )
+
+    [(_, msg)] = make_parser()._fetch_messages(imap, [b"3"])
+
+    assert imap.fetches[1] == ("3", "(BODY.PEEK[2]<0.65536>)")
+    assert msg["subject"] == "Printer broken"
+    assert make_parser().create_ticket_payload(msg)["content"] == "Hello world"
+
+
+def test_fetch_messages_falls_back_to_html_part():
+    imap = CannedImap(
+        [
+            literal(
+                b"1 (UID 9 BODYSTRUCTURE (" + HTML_PART
+                + b'("image" "png" NIL "<logo>" NIL "base64" 900 NIL NIL NIL NIL) "related")'
+                b" BODY[HEADER.FIELDS (SUBJECT FROM)]",
+                HEADERS_A
+            ),
+            b")",
+        ],
+        [
+            literal(b"1 (UID 9 BODY[1]<0>", b"<p>Hello world</p>"),
+            b")",
+        ],
+    )
+
+    [(_, msg)] = make_parser()._fetch_messages(imap, [b"9"])
+
+    assert imap.fetches[1] == ("9", "(BODY.PEEK[1]<0.65536>)")
+    assert make_parser().create_ticket_payload(msg)["content"] == "<p>Hello world</p>"
+
+
+@pytest.mark.parametrize("from_header, expected", [
+    ('"Ada Lovelace" <ada@example.org>', ("Ada", "Lovelace")),
+    ("John  Paul   Smith <jps@example.org>", ("John", "Paul Smith")),
+    ("John\tSmith <js@example.org>", ("John", "Smith")),
+    ("Cher <cher@example.org>", ("Cher", "")),
+    ("bob@example.org", ("bob@example.org", "")),
+    ("<anon@example.org>", ("", "")),
+    ("", ("", "")),
+])
+def test_parse_sender_name(from_header, expected):
+    assert make_parser().parse_sender_name(from_header) == expected
+
+
+def expand_uid_set(uid_set):
+    uids = []
+    for item in uid_set.split(","):
+        first, _, last = item.partition(":")
+        uids.extend(range(int(first), int(last or first) + 1))
+    return uids
+
+
+class MailboxImap:
+    """Stand-in for an imaplib connection serving single-part text messages by UID"""
+
+    def __init__(self, senders):
+        self.senders = senders
+        self.commands = []
+
+    def uid(self, command, uid_set, *args):
+        self.commands.append((command, uid_set) + args)
+        if command == "STORE":
+            return "OK", []
+        data = []
+        for seq, uid in enumerate(expand_uid_set(uid_set), 1):
+            if uid not in self.senders:
+                continue
+            if "BODYSTRUCTURE" in args[0]:
+                headers = b"Subject: Ticket %d\r\nFrom: %s\r\n\r\n" % (uid, self.senders[uid])
+                prefix = b"%d (UID %d BODYSTRUCTURE %s BODY[HEADER.FIELDS (SUBJECT FROM)]" % (seq, uid, PLAIN_PART)
+                data += [literal(prefix, headers), b")"]
+            else:
+                data += [literal(b"%d (UID %d BODY[1]<0>" % (seq, uid), b"Hello world"), b")"]
+        return "OK", data
+
+    def stored(self):
+        return [uid for command in self.commands if command[0] == "STORE" for uid in expand_uid_set(command[1])]
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def stub_webhook(monkeypatch, parser, failing_titles=()):
+    """Record webhook bodies, answering 500 for any body mentioning a failing title"""
+    posted = []
+
+    def post(url, json, timeout):
+        posted.append(json)
+        failed = any(title in str(json) for title in failing_titles)
+        return FakeResponse(500 if failed else 200)
+
+    monkeypatch.setattr(parser.session, "post", post)
+    return posted
+
+
+def test_uid_set_collapses_consecutive_runs():
+    assert run_python._uid_set([b"9", b"1", b"2", b"3", b"5", b"7", b"8"]) == "1:3,5,7:9"
+
+
+def test_process_messages_works_in_bounded_chunks(monkeypatch):
+    parser = make_parser()
+    monkeypatch.setattr(parser, "FETCH_CHUNK_SIZE", 3)
+    stub_webhook(monkeypatch, parser)
+    imap = MailboxImap({uid: b"user%d@example.org" % uid for uid in range(1, 8)})
+
+    assert parser._process_messages(imap, [str(uid).encode() for uid in range(1, 8)])
+
+    header_fetches = [command[1] for command in imap.commands if command[0] == "FETCH" and "BODYSTRUCTURE" in command[2]]
+    assert header_fetches == ["1:3", "4:6", "7"]
+    assert imap.stored() == list(range(1, 8))
+
+
+@pytest.mark.parametrize("senders", [{}, {1: b"user1@example.org"}])
+def test_process_messages_reports_messages_it_could_not_fetch(monkeypatch, senders):
+    parser = make_parser()
+    stub_webhook(monkeypatch, parser)
+    imap = MailboxImap(senders)
+
+    assert not parser._process_messages(imap, [b"1", b"2"])
+    assert imap.stored() == sorted(senders)
+
+
+@pytest.mark.parametrize("batch_webhook, stored", [
+    (False, [1, 2, 4, 5]),
+    (True, [1, 2, 5]),
+])
+def test_process_messages_flags_only_sent_tickets(monkeypatch, batch_webhook, stored):
+    parser = make_parser()
+    parser.batch_webhook = batch_webhook
+    monkeypatch.setattr(parser, "WEBHOOK_BATCH_SIZE", 2)
+    posted = stub_webhook(monkeypatch, parser, failing_titles=["Ticket 3"])
+    imap = MailboxImap({uid: b"user%d@example.org" % uid for uid in range(1, 6)})
+
+    assert not parser._process_messages(imap, [str(uid).encode() for uid in range(1, 6)])
+
+    assert len(posted) == (3 if batch_webhook else 5)
+    assert [command[0] for command in imap.commands].count("STORE") == 1
+    assert imap.stored() == stored
+
+
+@pytest.mark.parametrize("sender", [
+    b"Mail Delivery System <MAILER-DAEMON@mx1.mxfilter.net>",
+    b"Undisclosed",
+])
+def test_process_messages_skips_blocked_and_malformed_senders(monkeypatch, sender):
+    parser = make_parser()
+    posted = stub_webhook(monkeypatch, parser)
+    imap = MailboxImap({1: sender})
+
+    assert parser._process_messages(imap, [b"1"])
+
+    assert posted == []
+    assert imap.stored() == []